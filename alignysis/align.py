@@ -1,9 +1,12 @@
 import logging
 import re
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures.process import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
 
+import numpy as np
 import pandas as pd
 
 from kaldialign import align
@@ -12,9 +15,16 @@ from alignysis.phonetic import BABELCODE2LANG, IGNORED_SYMBOLS, determine_base
 
 GAP_CHAR = '*'
 
+# Kaldi: "<utt-id> <text>"; lines without any text are skipped.
+_KALDI_LINE_RE = re.compile(r'^[^\S\n]*(\S+)[^\S\n]+(\S.*?)\s*$', re.M)
+# ESPnet: "<text> (<utt-id>)"
+_ESPNET_LINE_RE = re.compile(r'^[ \t]*(.*?)[ \t]*\((\S+)\)\s*$', re.M)
 
-def get_ignored_symbols_re(symbols):
-    return re.compile(fr'({r"|".join(symbols)})')
+
+def get_ignored_symbols_re(symbols: Iterable[str]) -> Pattern:
+    # Escape the symbols, as many of them are punctuation-like, and try the longest first
+    # so that e.g. '<silence>' is removed as a whole rather than just its '<'.
+    return re.compile('(' + '|'.join(sorted(map(re.escape, symbols), key=len, reverse=True)) + ')')
 
 
 def read_kaldi(text_path) -> Dict[str, str]:
@@ -25,12 +35,7 @@ def read_kaldi(text_path) -> Dict[str, str]:
 
     Returns a mapping from an utterance ID to its text.
     """
-    id_to_text = dict(
-        filter(
-            lambda parts: len(parts) == 2,
-            (l.split(maxsplit=1) for l in text_path.read_text().splitlines())
-        )
-    )
+    id_to_text = dict(_KALDI_LINE_RE.findall(Path(text_path).read_text()))
     return id_to_text
 
 
@@ -40,14 +45,8 @@ def read_espnet(text_path) -> Dict[str, str]:
 
     Returns a mapping from an utterance ID to its text.
     """
-    id_to_text = {}
-    with Path(text_path).open() as f:
-        for line in f:
-            x = line.strip().rsplit(maxsplit=1)
-            if len(x) == 1:
-                x = '', x[0]  # empty text
-            symbols, id_ = x
-            id_to_text[id_[1:-1]] = symbols
+    # The text might be empty
+    id_to_text = {id_: symbols for symbols, id_ in _ESPNET_LINE_RE.findall(Path(text_path).read_text())}
     return id_to_text
 
 
@@ -67,11 +66,52 @@ def join_ref_hyp(id_to_ref: Dict[str, str], id_to_hyp: Dict[str, str]) -> List[D
     return sequence_pairs
 
 
+def _align_one(
+        item: Dict[str, str],
+        remove_pattern: Pattern,
+        scoring_method: str = 'per',
+) -> Optional[List[Tuple[str, str]]]:
+    """Pre-processes and aligns a single {'id': ..., 'ref': ..., 'hyp': ...} item."""
+    id_, ref, hyp = item['id'], item['ref'], item['hyp']
+    # Some hyps might be missing
+    if hyp is None:
+        return None
+
+    # Remove special symbols
+    ref = remove_pattern.sub('', ref)
+    hyp = remove_pattern.sub('', hyp)
+
+    # Convert to lists of phones
+    ref, hyp = ref.split(), hyp.split()
+
+    if scoring_method == 'pter':
+        ref = list(''.join(ref))
+        hyp = list(''.join(hyp))
+    elif scoring_method == 'bper':
+        # The conditional filters out the symbols for which we do not know the base;
+        # This is important for scoring phone token models as they will have tones etc.
+        # as separate symbols, and we don't want to mix them up with actual phones
+        ref = [b for b in map(determine_base, ref) if b != '?']
+        hyp = [b for b in map(determine_base, hyp) if b != '?']
+
+    # Align
+    ali = align(ref, hyp, GAP_CHAR)
+    if not ali:
+        return None
+    return ali
+
+
+def _count_symbols(symbols: np.ndarray) -> pd.Series:
+    uniq, counts = np.unique(symbols, return_counts=True)
+    return pd.Series(counts, index=uniq)
+
+
 def compute_confusions(
         sequence_pairs: Iterable[Dict[str, str]],
         lang: str,
         ignore_symbols=None,
         scoring_method='per',
+        num_jobs: int = 1,
 ) -> Tuple[pd.DataFrame, ...]:
     """
     Computes the alignments between the true and predicted sequences
@@ -86,72 +126,53 @@ def compute_confusions(
     :param lang: Language tag.
     :param ignore_symbols: A list of symbols to be removed prior to alignment.
     :param scoring_method: 'per' (default), 'pter' or 'bper'
+    :param num_jobs: Number of worker processes used for alignment; 1 (default) aligns in the current process.
+        Keep it at 1 when this function already runs inside a process pool (e.g. via ``read_e2e``/``read_hybrid``).
     :return:
     """
     # Regexp for ignoring symbols
+    if ignore_symbols is None:
+        ignore_symbols = ['<silence>']
     remove_pattern = get_ignored_symbols_re(ignore_symbols)
 
     # Compute the alignment
-    alis = []
-    for item in sequence_pairs:
-        id_, ref, hyp = item['id'], item['ref'], item['hyp']
-        # Some hyps might be missing
-        if hyp is None:
-            continue
-
-        # Remove special symbols
-        if remove_pattern is not None:
-            ref = remove_pattern.sub('', ref)
-            hyp = remove_pattern.sub('', hyp)
-        else:
-            ref = ref.replace(' <silence> ', ' ').replace('<silence>', '').strip()
-            hyp = hyp.replace(' <silence> ', ' ').replace('<silence>', '').strip()
-
-        # Convert to lists of phones
-        ref, hyp = ref.split(), hyp.split()
-
-        if scoring_method == 'pter':
-            ref = list(''.join(ref))
-            hyp = list(''.join(hyp))
-        elif scoring_method == 'bper':
-            # The conditional filters out the symbols for which we do not know the base;
-            # This is important for scoring phone token models as they will have tones etc.
-            # as separate symbols, and we don't want to mix them up with actual phones
-            ref = [determine_base(p) for p in ref if determine_base(p) != '?']
-            hyp = [determine_base(p) for p in hyp if determine_base(p) != '?']
-
-        # Align
-        ali = align(ref, hyp, GAP_CHAR)
-        if not ali:
-            continue
-        alis.append(ali)
+    work = partial(_align_one, remove_pattern=remove_pattern, scoring_method=scoring_method)
+    if num_jobs > 1:
+        with ProcessPoolExecutor(num_jobs) as ex:
+            alis = list(ex.map(work, sequence_pairs, chunksize=64))
+    else:
+        alis = list(map(work, sequence_pairs))
+    alis = [ali for ali in alis if ali is not None]
 
     # Parse the alignments to error types
-    errors = defaultdict(lambda: defaultdict(int))
-    confusions = defaultdict(lambda: defaultdict(int))
-    for ali in alis:
-        for ref, hyp in ali:
-            assert not (ref == GAP_CHAR and hyp == GAP_CHAR)
-            confusions[ref][hyp] += 1
-            if ref != GAP_CHAR:
-                errors[ref]['TOTAL_TRUE_COUNT'] += 1
-            if ref == hyp:
-                errors[ref]['OK'] += 1
-            elif ref == GAP_CHAR:
-                errors[hyp]['INSERTION'] += 1
-            elif hyp == GAP_CHAR:
-                errors[ref]['DELETION'] += 1
-            else:
-                errors[ref]['SUBSTITUTION'] += 1
+    all_pairs = [pair for ali in alis for pair in ali]
+    confusions = Counter(all_pairs)
+    refs = np.array([ref for ref, _ in all_pairs], dtype=str)
+    hyps = np.array([hyp for _, hyp in all_pairs], dtype=str)
+    is_ok = refs == hyps
+    is_ins = refs == GAP_CHAR
+    is_del = hyps == GAP_CHAR
+    assert not np.any(is_ins & is_del)
+    is_sub = ~(is_ok | is_ins | is_del)
+    ref_totals = _count_symbols(refs[~is_ins])
 
     # make dataframe
-    df = pd.DataFrame(errors).T
+    df = pd.DataFrame({
+        'TOTAL_TRUE_COUNT': ref_totals,
+        'OK': _count_symbols(refs[is_ok]),
+        'INSERTION': _count_symbols(hyps[is_ins]),
+        'DELETION': _count_symbols(refs[is_del]),
+        'SUBSTITUTION': _count_symbols(refs[is_sub]),
+    })
     df['LANG'] = lang
-    confusions_df = pd.DataFrame([
-        {'ref': ref, 'hyp': hyp, 'count': count, 'total_ref': errors[ref]['TOTAL_TRUE_COUNT'], 'lang': lang}
-        for ref, hyps in confusions.items()
-        for hyp, count in hyps.items()
-    ])
+    conf_refs, conf_hyps = zip(*confusions) if confusions else ((), ())
+    confusions_df = pd.DataFrame({
+        'ref': conf_refs,
+        'hyp': conf_hyps,
+        'count': list(confusions.values()),
+        'total_ref': ref_totals.reindex(list(conf_refs), fill_value=0).to_numpy(),
+        'lang': lang,
+    })
 
     return df, confusions_df
 
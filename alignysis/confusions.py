@@ -30,17 +30,15 @@ def to_matrix(
     else:
         int2sym = sorted(labels)
     sym2int = {s: i for i, s in enumerate(int2sym)}
-    mtx = np.zeros((len(int2sym), len(int2sym)))
-    for idx, row in df.iterrows():
-        ref_idx = sym2int[row[ref_field]]
-        hyp_idx = sym2int[row[hyp_field]]
-        mtx[ref_idx, hyp_idx] += row['count']
+    mtx = np.zeros((len(int2sym), len(int2sym)), dtype=np.float64)
+    ref_idx = df[ref_field].map(sym2int).to_numpy(np.intp)
+    hyp_idx = df[hyp_field].map(sym2int).to_numpy(np.intp)
+    np.add.at(mtx, (ref_idx, hyp_idx), df['count'].to_numpy())
     if occ_thresh > 0:
         mtx = np.where(mtx >= occ_thresh, mtx, 0)
     if norm:
-        den = np.sum(mtx, axis=1)
-        mtx = (mtx.T / den).T
-        mtx[np.isnan(mtx)] = 0
+        den = mtx.sum(axis=1, keepdims=True)
+        mtx = np.divide(mtx, den, out=np.zeros_like(mtx), where=den != 0)
     if log:
         mtx = np.log10(mtx)
     fig = ConfusionMatrixDisplay(mtx, display_labels=np.array(list(sym2int)))
@@ -48,13 +46,9 @@ def to_matrix(
 
 
 def symmetrize_confusions(mtx: np.ndarray) -> np.ndarray:
-    mtx = mtx.copy()
-    for i in range(0, mtx.shape[0]):
-        mtx[i, i] = 0
-        for j in range(i + 1, mtx.shape[1]):
-            tot = (mtx[i, j] + mtx[j, i]) / 2
-            mtx[i, j] = mtx[j, i] = tot
-    return mtx
+    out = (mtx + mtx.T) * 0.5
+    np.fill_diagonal(out, 0.0)
+    return out
 
 
 def plot_similarity_dendrogram(similarities, labels):
@@ -1,44 +1,67 @@
+import gzip
 import logging
 import pickle
 from concurrent.futures.process import ProcessPoolExecutor
 from pathlib import Path
 from functools import partial
+from typing import Dict, Tuple
 
+import numpy as np
 import pandas as pd
 
 from alignysis import IGNORED_SYMBOLS, determine_manner, determine_place, get_special_symbols, process_asr_results
 from alignysis.logging import setup_logger
 
 
+def _process_asr_task(task, ignored_symbols):
+    key, ref_path, hyp_path = task
+    scoring_method = key[-1]
+    return key, process_asr_results(ref_path, hyp_path, ignored_symbols=ignored_symbols, scoring_method=scoring_method)
+
+
+def _run_asr_tasks(tasks, ignored_symbols, num_jobs: int, executor_type):
+    """
+    Processes all (key, ref_path, hyp_path) tasks in a single pool submission
+    and groups the per-language results by their experiment key.
+    """
+    # Wrap into partial for easier parallelism
+    work = partial(_process_asr_task, ignored_symbols=ignored_symbols)
+    logging.info(f'Processing {len(tasks)} queued ASR results.')
+    with executor_type(num_jobs) as ex:
+        results = list(ex.map(work, tasks, chunksize=8))
+
+    grouped = {}
+    for key, result in results:
+        grouped.setdefault(key, []).append(result)
+
+    expt_dfs = {}
+    expt_confusions = {}
+    sequences = {}
+    for key, key_results in grouped.items():
+        sequence_pairs, langs, lang_dfs, lang_confusions = zip(*key_results)
+        sequences[key] = dict(zip(langs, sequence_pairs))
+        expt_dfs[key] = lang_dfs
+        expt_confusions[key] = lang_confusions
+    return sequences, expt_dfs, expt_confusions
+
+
 def read_e2e(root: Path, tag: str, num_jobs: int = 8, executor_type=ProcessPoolExecutor):
     # In E2E experiments we read the ground truth from mono experiments reference text
     ground_truth_paths = sorted(p for p in (root / 'mono').rglob('ref.trn'))
     special_symbols = get_special_symbols(ground_truth_paths)
     special_symbols |= set(IGNORED_SYMBOLS)
 
-    expt_dfs = {}
-    expt_confusions = {}
-    sequences = {}
     # We use the "subexpt" for consistency with hybrid expts, as they have multiple LMs for each AM
     subexpt = None
-    with executor_type(num_jobs) as ex:
-        for scoring_method in ['per', 'pter', 'bper']:
-            for expt in ['mono', 'multi', 'cross']:
-                logging.info(f'[E2E] Reading {expt} expts with {scoring_method.upper()} scoring.')
-                exp_root = root / expt
-                results_paths = sorted(exp_root.rglob('hyp.trn'))
-                # Wrap into partial for easier parallelism
-                work = partial(
-                    process_asr_results,
-                    ignored_symbols=special_symbols,
-                    scoring_method=scoring_method
-                )
-                sequence_pairs, langs, lang_dfs, lang_confusions = zip(*list(ex.map(work, ground_truth_paths, results_paths)))
-                key = (tag, expt, subexpt, scoring_method)
-                sequences[key] = dict(zip(langs, sequence_pairs))
-                expt_dfs[key] = lang_dfs
-                expt_confusions[key] = lang_confusions
-    return sequences, expt_dfs, expt_confusions
+    tasks = []
+    for scoring_method in ['per', 'pter', 'bper']:
+        for expt in ['mono', 'multi', 'cross']:
+            logging.info(f'[E2E] Queueing {expt} expts for {scoring_method.upper()} scoring.')
+            exp_root = root / expt
+            results_paths = sorted(exp_root.rglob('hyp.trn'))
+            key = (tag, expt, subexpt, scoring_method)
+            tasks.extend((key, gt, hyp) for gt, hyp in zip(ground_truth_paths, results_paths))
+    return _run_asr_tasks(tasks, special_symbols, num_jobs=num_jobs, executor_type=executor_type)
 
 
 def read_hybrid(root: Path, tag: str, num_jobs: int = 8, executor_type=ProcessPoolExecutor):
@@ -47,31 +70,17 @@ def read_hybrid(root: Path, tag: str, num_jobs: int = 8, executor_type=ProcessPo
     special_symbols = get_special_symbols(ground_truth_paths)
     special_symbols |= set(IGNORED_SYMBOLS)
 
-    ex = executor_type(num_jobs)
-
-    expt_dfs = {}
-    expt_confusions = {}
-    sequences = {}
-    with ex:
-        for scoring_method in ['per', 'pter', 'bper']:
-            for expt in ['mono', 'multi', 'cross']:
-                exp_root = root / f'{expt}_tdnnf'
-                for subexpt_path in exp_root.glob('*'):
-                    subexpt = subexpt_path.name
-                    logging.info(f'[Hybrid] Reading {expt}/{subexpt} expts with {scoring_method.upper()} scoring.')
-                    results_paths = sorted((root / f'{expt}_tdnnf/{subexpt}').rglob('*.tra'))
-                    # Wrap into partial for easier parallelism
-                    work = partial(
-                        process_asr_results,
-                        ignored_symbols=special_symbols,
-                        scoring_method=scoring_method
-                    )
-                    sequence_pairs, langs, lang_dfs, lang_confusions = zip(*list(ex.map(work, ground_truth_paths, results_paths)))
-                    key = (tag, expt, subexpt, scoring_method)
-                    sequences[key] = dict(zip(langs, sequence_pairs))
-                    expt_dfs[key] = lang_dfs
-                    expt_confusions[key] = lang_confusions
-    return sequences, expt_dfs, expt_confusions
+    tasks = []
+    for scoring_method in ['per', 'pter', 'bper']:
+        for expt in ['mono', 'multi', 'cross']:
+            exp_root = root / f'{expt}_tdnnf'
+            for subexpt_path in exp_root.glob('*'):
+                subexpt = subexpt_path.name
+                logging.info(f'[Hybrid] Queueing {expt}/{subexpt} expts for {scoring_method.upper()} scoring.')
+                results_paths = sorted(subexpt_path.rglob('*.tra'))
+                key = (tag, expt, subexpt, scoring_method)
+                tasks.extend((key, gt, hyp) for gt, hyp in zip(ground_truth_paths, results_paths))
+    return _run_asr_tasks(tasks, special_symbols, num_jobs=num_jobs, executor_type=executor_type)
 
 
 def read_all_expts(root: Path = Path('/Users/pzelasko/jhu/discophone')):
@@ -100,6 +109,20 @@ def read_all_expts(root: Path = Path('/Users/pzelasko/jhu/discophone')):
     return sequences, expt_dfs, expt_confusions
 
 
+def _concat_expts(merged_dfs: Dict[Tuple, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates the per-experiment DFs once and tags each row with its experiment
+    (keyed by ``(tag, AM, LM, tok_type)``) by repeating the keys over the DF lengths.
+    """
+    keys = list(merged_dfs)
+    lens = [len(d) for d in merged_dfs.values()]
+    df = pd.concat(merged_dfs.values(), ignore_index=True)
+    for idx, col in enumerate(['SYSTEM', 'AM', 'LM', 'TOKEN_TYPE']):
+        df[col] = np.repeat(np.array([key[idx] for key in keys], dtype=object), lens)
+    df['EXP'] = np.repeat([f'{tag}_{AM}_{LM}_{tok_type}' for tag, AM, LM, tok_type in keys], lens)
+    return df
+
+
 def aggregate_confusions(conf_dfs):
     conf_merged_dfs = {
         ex: pd.concat(lang_dfs)
@@ -111,16 +134,7 @@ def aggregate_confusions(conf_dfs):
     #     for ex, df in conf_merged_dfs.items()
     # }
 
-    to_concat = []
-    for (tag, AM, LM, tok_type), cdf in conf_merged_dfs.items():
-        cdf['SYSTEM'] = tag
-        cdf['AM'] = AM
-        cdf['LM'] = LM
-        cdf['TOKEN_TYPE'] = tok_type
-        cdf['EXP'] = f'{tag}_{AM}_{LM}_{tok_type}'
-        to_concat.append(cdf)
-
-    df = pd.concat(to_concat)
+    df = _concat_expts(conf_merged_dfs)
     # df = df[~df.token.str.contains('<')]
     return df
 
@@ -143,73 +157,82 @@ def aggregate_expts(expt_dfs):
         for ex, df in expt_merged_dfs.items()
     }
 
-    to_concat = []
-    for (tag, AM, LM, tok_type), edf in expt_merged_dfs.items():
-        edf['SYSTEM'] = tag
-        edf['AM'] = AM
-        edf['LM'] = LM
-        edf['TOKEN_TYPE'] = tok_type
-        edf['EXP'] = f'{tag}_{AM}_{LM}_{tok_type}'
-        to_concat.append(edf)
-
-    df = pd.concat(to_concat)
+    df = _concat_expts(expt_merged_dfs)
 
-    df.loc[~df.TOTAL_TRUE_COUNT.isna() & df.OK.isna(), 'OK'] = 0.0
-    df.loc[~df.TOTAL_TRUE_COUNT.isna() & df.DELETION.isna(), 'DELETION'] = 0.0
-    df.loc[~df.TOTAL_TRUE_COUNT.isna() & df.SUBSTITUTION.isna(), 'SUBSTITUTION'] = 0.0
-    df.loc[~df.TOTAL_TRUE_COUNT.isna() & df.INSERTION.isna(), 'INSERTION'] = 0.0
+    # Symbols that occur in the reference but never had a given error type have 0 such errors
+    mask = df.TOTAL_TRUE_COUNT.notna()
+    cols = ['OK', 'DELETION', 'SUBSTITUTION', 'INSERTION']
+    df.loc[mask, cols] = df.loc[mask, cols].fillna(0.0).to_numpy()
 
     df = df[~df.token.str.contains('<')]
 
     return df
 
 
+def _save_pickle(obj, path: Path):
+    # Level 1 gzip is cheap on CPU and still roughly halves the size on disk
+    with gzip.open(path, 'wb', compresslevel=1) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(path: Path):
+    with gzip.open(path, 'rb') as f:
+        return pickle.load(f)
+
+
 def run_data_prep(force: bool = False):
     setup_logger()
-    SEQS_PATH = Path('art/sequences.pkl')
-    AGG_PATH = Path('art/agg_df.pkl')
-    AGG_CONF_PATH = Path('art/agg_conf_df.pkl')
+    SEQS_PATH = Path('art/sequences.pkl.gz')
+    AGG_PATH = Path('art/agg_df.feather')
+    AGG_CONF_PATH = Path('art/agg_conf_df.feather')
     if SEQS_PATH.exists() and AGG_PATH.exists() and AGG_CONF_PATH.exists() and not force:
         logging.info('Reading cached aggregated DFs.')
         return (
-            pickle.load(SEQS_PATH.open('rb')),
-            pickle.load(AGG_PATH.open('rb')),
-            pickle.load(AGG_CONF_PATH.open('rb'))
+            _load_pickle(SEQS_PATH),
+            pd.read_feather(AGG_PATH),
+            pd.read_feather(AGG_CONF_PATH)
         )
 
-    EXPT_PATH = Path('art/expt_dfs.pkl')
-    CONF_PATH = Path('art/expt_confusions.pkl')
+    EXPT_PATH = Path('art/expt_dfs.pkl.gz')
+    CONF_PATH = Path('art/expt_confusions.pkl.gz')
     if SEQS_PATH.exists() and EXPT_PATH.exists() and CONF_PATH.exists() and not force:
         logging.info('Reading cached per-experiment DFs.')
-        sequences = pickle.load(SEQS_PATH.open('rb'))
-        dfs = pickle.load(EXPT_PATH.open('rb'))
-        confs = pickle.load(CONF_PATH.open('rb'))
+        sequences = _load_pickle(SEQS_PATH)
+        dfs = _load_pickle(EXPT_PATH)
+        confs = _load_pickle(CONF_PATH)
     else:
         logging.info('Computing alignments and confusions from raw results.')
         sequences, dfs, confs = read_all_expts()
-        pickle.dump(sequences, open(SEQS_PATH, 'wb'))
-        pickle.dump(dfs, open(EXPT_PATH, 'wb'))
-        pickle.dump(confs, open(CONF_PATH, 'wb'))
+        _save_pickle(sequences, SEQS_PATH)
+        _save_pickle(dfs, EXPT_PATH)
+        _save_pickle(confs, CONF_PATH)
 
     if AGG_PATH.exists() and not force:
         logging.info('Reading cached aggregated alignment DF.')
-        df = pickle.load(AGG_PATH.open('rb'))
+        df = pd.read_feather(AGG_PATH)
     else:
         logging.info('Aggregating per-experiment alignments.')
         df = aggregate_expts(dfs)
-        pickle.dump(df, open(AGG_PATH, 'wb'))
+        # Feather requires a default index; the concatenated one carries no information anyway
+        df = df.reset_index(drop=True)
+        df.to_feather(AGG_PATH)
 
     if AGG_CONF_PATH.exists() and not force:
         logging.info('Reading cached aggregated confusions DF.')
-        conf_df = pickle.load(AGG_CONF_PATH.open('rb'))
+        conf_df = pd.read_feather(AGG_CONF_PATH)
     else:
         logging.info('Aggregating per-experiment confusions.')
         conf_df = aggregate_confusions(confs)
-        conf_df['ref_place'] = conf_df.ref.apply(lambda phn: determine_place(phn))
-        conf_df['hyp_place'] = conf_df.hyp.apply(lambda phn: determine_place(phn))
-        conf_df['ref_manner'] = conf_df.ref.apply(lambda phn: determine_manner(phn))
-        conf_df['hyp_manner'] = conf_df.hyp.apply(lambda phn: determine_manner(phn))
-        pickle.dump(conf_df, open(AGG_CONF_PATH, 'wb'))
+        # Tag each unique symbol once and broadcast with a dict lookup per row
+        uniq = pd.unique(pd.concat([conf_df.ref, conf_df.hyp]))
+        place_map = {s: determine_place(s) for s in uniq}
+        manner_map = {s: determine_manner(s) for s in uniq}
+        conf_df['ref_place'] = conf_df.ref.map(place_map)
+        conf_df['hyp_place'] = conf_df.hyp.map(place_map)
+        conf_df['ref_manner'] = conf_df.ref.map(manner_map)
+        conf_df['hyp_manner'] = conf_df.hyp.map(manner_map)
+        conf_df = conf_df.reset_index(drop=True)
+        conf_df.to_feather(AGG_CONF_PATH)
 
     logging.info('DF prep finished!')
     return sequences, df, conf_df
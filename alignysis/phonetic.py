@@ -1,5 +1,7 @@
+import re
 from collections import Counter, defaultdict
 from functools import lru_cache
+from typing import Pattern
 
 BABELCODE2LANG = {
     "101": "Cantonese",
@@ -91,74 +93,75 @@ phone_to_place = {
 }
 
 
-def determine_place(phone: str, phone_to_place=phone_to_place):
+def _compile_prefix_re(prefixes) -> Pattern:
+    # Longest alternatives first so that the longest matching prefix wins;
+    # the optional leading stress symbol is skipped.
+    alternatives = sorted(map(re.escape, prefixes), key=len, reverse=True)
+    return re.compile('^ˈ?(' + '|'.join(alternatives) + ')')
+
+
+PHONE_BASES = frozenset(phone_to_place).union(phone_to_manner)
+
+_BASE_RE = _compile_prefix_re(PHONE_BASES)
+_PLACE_RE = _compile_prefix_re(phone_to_place)
+_MANNER_RE = _compile_prefix_re(phone_to_manner)
+
+
+@lru_cache(maxsize=4096)
+def determine_place(phone: str):
     # Empty token - insertion or deletion
     if phone == '*':
         return phone
-    # Remove stress symbol
-    if phone.startswith('ˈ'):
-        phone = phone[1:]
-    for phone_tok in phone_to_place:
-        if phone.startswith(phone_tok):
-            return phone_to_place[phone_tok]
-    return '?'
+    m = _PLACE_RE.match(phone)
+    return phone_to_place[m.group(1)] if m else '?'
 
 
-def determine_manner(phone: str, phone_to_manner=phone_to_manner):
+@lru_cache(maxsize=4096)
+def determine_manner(phone: str):
     # Empty token - insertion or deletion
     if phone == '*':
         return phone
-    # Remove stress symbol
-    if phone.startswith('ˈ'):
-        phone = phone[1:]
-    for phone_tok in phone_to_manner:
-        if phone.startswith(phone_tok):
-            return phone_to_manner[phone_tok]
-    return '?'
-
-
-PHONE_BASES = frozenset(phone_to_place).union(phone_to_manner)
+    m = _MANNER_RE.match(phone)
+    return phone_to_manner[m.group(1)] if m else '?'
 
 
-def determine_base(phone: str, bases_=PHONE_BASES):
+@lru_cache(maxsize=4096)
+def determine_base(phone: str):
     # Empty token - insertion or deletion
     if phone == '*':
         return phone
-    # Remove stress symbol
-    if phone.startswith('ˈ'):
-        phone = phone[1:]
-    for base in bases_:
-        if phone.startswith(base):
-            return base
-    return '?'
+    m = _BASE_RE.match(phone)
+    return m.group(1) if m else '?'
 
 
 def get_lang_to_phones(ground_truth_paths):
     lang_to_phones = defaultdict(Counter)
-    for p in ground_truth_paths:
-        lang = BABELCODE2LANG.get(p.stem, p.stem)
-        for line in p.open():
-            phones = line.strip().split()[1:]
-            for p in phones:
-                if not any(p.startswith(sym) for sym in '<<'):
-                    lang_to_phones[lang][p] += 1
+    for path in ground_truth_paths:
+        lang = BABELCODE2LANG.get(path.stem, path.stem)
+        with path.open() as f:
+            for line in f:
+                lang_to_phones[lang].update(p for p in line.split()[1:] if p[:1] != '<')
     return lang_to_phones
 
 
 def get_special_symbols(ground_truth_paths):
     syms = set()
-    for p in ground_truth_paths:
-        for line in p.open():
-            phones = line.strip().split()[1:]
-            for p in phones:
-                # The two characters below are actually different
-                if any(p.startswith(sym) for sym in '<<'):
-                    syms.add(p)
+    for path in ground_truth_paths:
+        with path.open() as f:
+            for line in f:
+                syms.update(p for p in line.split()[1:] if p[:1] == '<')
     return syms
 
 
-def get_lang_to_places(ground_truth_paths, unique=False):
-    lang_to_phones = get_lang_to_phones(ground_truth_paths)
+def get_lang_to_places(ground_truth_paths=None, unique=False, *, lang_to_phones=None):
+    """
+    Pass a ``lang_to_phones`` mapping computed with ``get_lang_to_phones`` to avoid re-reading
+    the ground truth; otherwise it is computed from ``ground_truth_paths``.
+    """
+    if lang_to_phones is None:
+        if ground_truth_paths is None:
+            raise ValueError('Either ground_truth_paths or lang_to_phones must be provided.')
+        lang_to_phones = get_lang_to_phones(ground_truth_paths)
     lang_to_places = defaultdict(Counter)
     for lang, phone_counts in lang_to_phones.items():
         for phone, count in phone_counts.items():
@@ -167,8 +170,15 @@ def get_lang_to_places(ground_truth_paths, unique=False):
     return lang_to_places
 
 
-def get_lang_to_manners(ground_truth_paths, unique=False):
-    lang_to_phones = get_lang_to_phones(ground_truth_paths)
+def get_lang_to_manners(ground_truth_paths=None, unique=False, *, lang_to_phones=None):
+    """
+    Pass a ``lang_to_phones`` mapping computed with ``get_lang_to_phones`` to avoid re-reading
+    the ground truth; otherwise it is computed from ``ground_truth_paths``.
+    """
+    if lang_to_phones is None:
+        if ground_truth_paths is None:
+            raise ValueError('Either ground_truth_paths or lang_to_phones must be provided.')
+        lang_to_phones = get_lang_to_phones(ground_truth_paths)
     lang_to_manners = defaultdict(Counter)
     for lang, phone_counts in lang_to_phones.items():
         for phone, count in phone_counts.items():
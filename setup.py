@@ -8,7 +8,7 @@ setup(
     author='Piotr Żelasko',
     license='Apache-2.0 License',
     packages=find_packages(),
-    install_requires=['pandas', 'seaborn', 'kaldialign', 'scikit-learn', 'plotly', 'jupyterlab', 'matplotlib', 'numpy', 'tqdm', 'iteration_utilities', 'scipy', 'networkx'],
+    install_requires=['pandas', 'seaborn', 'kaldialign', 'scikit-learn', 'plotly', 'jupyterlab', 'matplotlib', 'numpy', 'pyarrow', 'tqdm', 'iteration_utilities', 'scipy', 'networkx'],
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Programming Language :: Python :: 3.6",